@@ -1,61 +1,113 @@
+from __future__ import annotations
+
 import contextlib
+import selectors
 import socket
 import threading
-import time
 import unittest
 
 import zpl_toolchain
 
+# Bytes read per recv call by the mock printer; large enough that a typical
+# label arrives in a single syscall.
+RECV_CHUNK_SIZE = 65536
+
 
 class MockPrinterServer:
     def __init__(self) -> None:
         self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # Set before listen() so accepted sockets inherit it and the TCP
+        # window scale negotiated in the handshake can make use of it.
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
         self._sock.bind(("127.0.0.1", 0))
         self._sock.listen(5)
-        self._sock.settimeout(0.2)
         self.host = "127.0.0.1"
         self.port = self._sock.getsockname()[1]
-        self.received_payloads: list[str] = []
-        self._running = True
+        self.received_payloads: list[bytes] = []
+        self.payload_received = threading.Event()
+        self._recvbuf = bytearray(RECV_CHUNK_SIZE)
+        self._closing = threading.Event()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._sock, selectors.EVENT_READ)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
         self._thread = threading.Thread(target=self._serve, daemon=True)
         self._thread.start()
 
     def _serve(self) -> None:
-        while self._running:
+        while True:
+            events = self._selector.select()
+            if self._wake_requested(events):
+                break
             try:
                 conn, _ = self._sock.accept()
-            except socket.timeout:
-                continue
             except OSError:
                 break
 
             with conn:
-                conn.settimeout(0.2)
-                received = bytearray()
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                conn.setblocking(False)
                 try:
-                    while True:
-                        chunk = conn.recv(4096)
-                        if not chunk:
-                            break
-                        received.extend(chunk)
-                except socket.timeout:
-                    pass
+                    total = self._receive(conn)
                 except OSError:
                     continue
-                payload = bytes(received)
-                if not payload:
+                if self._closing.is_set():
+                    break
+                if not total:
                     continue
-                text = payload.decode("utf-8", errors="replace")
-                self.received_payloads.append(text)
+                self.received_payloads.append(bytes(self._recvbuf[:total]))
+                self.payload_received.set()
+
+    def _receive(self, conn: socket.socket) -> int:
+        total = 0
+        with selectors.DefaultSelector() as selector:
+            selector.register(conn, selectors.EVENT_READ)
+            selector.register(self._wake_r, selectors.EVENT_READ)
+            while True:
+                events = selector.select(timeout=0.2)
+                if not events:
+                    return total
+                if self._wake_requested(events):
+                    return total
+                while True:
+                    if total == len(self._recvbuf):
+                        self._recvbuf.extend(bytes(RECV_CHUNK_SIZE))
+                    try:
+                        with memoryview(self._recvbuf) as view:
+                            n = conn.recv_into(view[total : total + RECV_CHUNK_SIZE])
+                    except BlockingIOError:
+                        break
+                    if not n:
+                        return total
+                    total += n
+
+    def _wake_requested(self, events: list[tuple[selectors.SelectorKey, int]]) -> bool:
+        return any(key.fileobj is self._wake_r for key, _ in events)
 
     def close(self) -> None:
-        self._running = False
+        self._closing.set()
+        self._wake_w.send(b"x")
+        self._thread.join(timeout=1)
+        self._selector.close()
         with contextlib.suppress(OSError):
             self._sock.close()
-        self._thread.join(timeout=1)
+        self._wake_r.close()
+        self._wake_w.close()
 
 
 class PythonBindingApiTests(unittest.TestCase):
+    server: MockPrinterServer
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.server = MockPrinterServer()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.server.close()
+
     def test_parse_returns_ast_dict(self) -> None:
         result = zpl_toolchain.parse("^XA^FO50,50^FDHELLO^FS^XZ")
         self.assertIsInstance(result, dict)
@@ -88,41 +140,29 @@ class PythonBindingApiTests(unittest.TestCase):
         with self.assertRaises(ValueError):
             zpl_toolchain.validate_with_tables("^XA^XZ", "{invalid")
 
-    def test_print_with_options_rejects_zero_timeout(self) -> None:
-        with self.assertRaises(RuntimeError) as ctx:
-            zpl_toolchain.print_zpl_with_options(
-                "^XA^XZ",
-                "127.0.0.1:9100",
-                None,
-                False,
-                0,
-                None,
-            )
-        self.assertIn("timeout_ms must be > 0", str(ctx.exception))
-
-    def test_query_status_with_options_rejects_zero_timeout(self) -> None:
-        with self.assertRaises(RuntimeError) as ctx:
-            zpl_toolchain.query_printer_status_with_options("127.0.0.1:9100", 0, None)
-        self.assertIn("timeout_ms must be > 0", str(ctx.exception))
-
-    def test_query_info_with_options_rejects_zero_timeout(self) -> None:
-        with self.assertRaises(RuntimeError) as ctx:
-            zpl_toolchain.query_printer_info_with_options("127.0.0.1:9100", 0, None)
-        self.assertIn("timeout_ms must be > 0", str(ctx.exception))
+    def test_with_options_apis_reject_zero_timeout(self) -> None:
+        cases = (
+            (
+                zpl_toolchain.print_zpl_with_options,
+                ("^XA^XZ", "127.0.0.1:9100", None, False, 0, None),
+            ),
+            (zpl_toolchain.query_printer_status_with_options, ("127.0.0.1:9100", 0, None)),
+            (zpl_toolchain.query_printer_info_with_options, ("127.0.0.1:9100", 0, None)),
+        )
+        for api, args in cases:
+            with self.subTest(api=api.__name__):
+                with self.assertRaisesRegex(RuntimeError, "timeout_ms must be > 0"):
+                    api(*args)
 
     def test_print_zpl_sends_payload_to_mock_printer(self) -> None:
-        server = MockPrinterServer()
-        try:
-            result = zpl_toolchain.print_zpl("^XA^FO20,20^FDTEST^FS^XZ", f"{server.host}:{server.port}", None, False)
-            for _ in range(20):
-                if server.received_payloads:
-                    break
-                time.sleep(0.01)
-        finally:
-            server.close()
+        server = self.server
+        server.received_payloads.clear()
+        server.payload_received.clear()
+        result = zpl_toolchain.print_zpl("^XA^FO20,20^FDTEST^FS^XZ", f"{server.host}:{server.port}", None, False)
+        self.assertTrue(server.payload_received.wait(timeout=0.2))
         self.assertTrue(result["success"])
         self.assertGreater(result["bytes_sent"], 0)
-        self.assertTrue(any("^XA" in payload for payload in server.received_payloads))
+        self.assertTrue(any(b"^XA" in payload for payload in server.received_payloads))
 
 if __name__ == "__main__":
     unittest.main()
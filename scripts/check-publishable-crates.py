@@ -4,12 +4,25 @@
 Checks:
 1) Publishable crates must not use path-only dependencies (path without version).
 2) Publishable crates must package cleanly via `cargo package --list --no-verify`.
+
+With `--cache`, crates that passed check 2 are recorded in
+`target/.publish-preflight-cache.json` and skipped until cargo or the mtime of one
+of their tracked inputs changes: the workspace manifest, `Cargo.lock`, the crate
+manifest and the manifests of its workspace path dependencies, and the crate's
+readme, license-file, and build script. Other packaged sources (for example
+`include` paths) are not tracked, so the cache is meant for local iteration only;
+CI runs without it.
 """
 
 from __future__ import annotations
 
+import argparse
+import functools
+import json
+import re
 import subprocess
 import sys
+from collections.abc import Iterator
 from dataclasses import dataclass
 from pathlib import Path
 
@@ -18,6 +31,8 @@ import tomllib
 
 ROOT = Path(__file__).resolve().parents[1]
 DEPENDENCY_SECTIONS = ("dependencies", "build-dependencies", "dev-dependencies")
+FAILED_PACKAGE_RE = re.compile(r"package `([^`\s]+) v")
+PACKAGE_CACHE = ROOT / "target" / ".publish-preflight-cache.json"
 
 
 @dataclass(frozen=True)
@@ -27,8 +42,10 @@ class Package:
     publish: bool
 
 
+@functools.lru_cache(maxsize=None)
 def load_toml(path: Path) -> dict:
-    return tomllib.loads(path.read_text(encoding="utf-8"))
+    with path.open("rb") as f:
+        return tomllib.load(f)
 
 
 def workspace_members() -> list[Path]:
@@ -40,10 +57,13 @@ def workspace_members() -> list[Path]:
 def publishable_packages() -> list[Package]:
     packages: list[Package] = []
     for manifest in workspace_members():
-        if not manifest.exists():
+        try:
+            data = load_toml(manifest)
+        except FileNotFoundError:
+            continue
+        package = data.get("package")
+        if not package:
             continue
-        data = load_toml(manifest)
-        package = data.get("package", {})
         name = package.get("name")
         if not name:
             continue
@@ -52,63 +72,251 @@ def publishable_packages() -> list[Package]:
     return [package for package in packages if package.publish]
 
 
-def check_path_dependency_versions(packages: list[Package]) -> list[str]:
+def pathless_dependencies(data: dict) -> Iterator[tuple[str, str]]:
+    for section in DEPENDENCY_SECTIONS:
+        deps = data.get(section)
+        if not deps:
+            continue
+        for dep_name, spec in deps.items():
+            if not isinstance(spec, dict):
+                continue
+            has_path = "path" in spec
+            has_version = "version" in spec
+            if has_path and not has_version:
+                yield section, dep_name
+
+
+def check_path_dependency_versions(
+    packages: list[Package], first_error: bool = False
+) -> list[str]:
     errors: list[str] = []
     for package in packages:
         data = load_toml(package.manifest)
-        for section in DEPENDENCY_SECTIONS:
-            deps = data.get(section, {})
-            for dep_name, spec in deps.items():
+        rel = package.manifest.relative_to(ROOT)
+        for section, dep_name in pathless_dependencies(data):
+            errors.append(f"{rel}: {section}.{dep_name} uses path without version")
+            if first_error:
+                return errors
+    return errors
+
+
+def cargo_version() -> str | None:
+    result = subprocess.run(
+        ["cargo", "--version"],
+        cwd=ROOT,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+        check=False,
+    )
+    if result.returncode != 0:
+        return None
+    return result.stdout.strip()
+
+
+def path_dependency_manifests(
+    crate_dir: Path, data: dict, workspace: dict | None
+) -> Iterator[Path]:
+    workspace_deps = workspace.get("dependencies") if workspace else None
+    for section in DEPENDENCY_SECTIONS:
+        deps = data.get(section)
+        if not deps:
+            continue
+        for dep_name, spec in deps.items():
+            if not isinstance(spec, dict):
+                continue
+            base = crate_dir
+            if spec.get("workspace"):
+                if not workspace_deps:
+                    continue
+                spec = workspace_deps.get(dep_name)
                 if not isinstance(spec, dict):
                     continue
-                has_path = "path" in spec
-                has_version = "version" in spec
-                if has_path and not has_version:
-                    rel = package.manifest.relative_to(ROOT)
-                    errors.append(
-                        f"{rel}: {section}.{dep_name} uses path without version"
-                    )
-    return errors
+                base = ROOT
+            path = spec.get("path")
+            if path:
+                yield base / path / "Cargo.toml"
 
 
-def check_package_list(packages: list[Package]) -> list[str]:
-    errors: list[str] = []
+def package_cache_inputs(package: Package) -> list[Path]:
+    # Member manifests inherit fields from the workspace manifest, and cargo
+    # package also reads the lockfile, the manifests of path dependencies
+    # (whose versions it checks), and the files named by the manifest.
+    workspace = load_toml(ROOT / "Cargo.toml").get("workspace")
+    inputs = [ROOT / "Cargo.toml", ROOT / "Cargo.lock"]
+    seen: set[Path] = set()
+    pending = [package.manifest]
+    while pending:
+        manifest = pending.pop()
+        if manifest in seen:
+            continue
+        seen.add(manifest)
+        inputs.append(manifest)
+        try:
+            data = load_toml(manifest)
+        except FileNotFoundError:
+            continue
+        pending.extend(path_dependency_manifests(manifest.parent, data, workspace))
+
+    crate_dir = package.manifest.parent
+    table = load_toml(package.manifest).get("package")
+    if not table:
+        return inputs
+    workspace_package = workspace.get("package") if workspace else None
+    for field in ("readme", "license-file"):
+        value = table.get(field)
+        base = crate_dir
+        if isinstance(value, dict) and value.get("workspace"):
+            value = workspace_package.get(field) if workspace_package else None
+            base = ROOT
+        if isinstance(value, str):
+            inputs.append(base / value)
+        elif field == "readme" and value is True:
+            inputs.append(base / "README.md")
+        elif field == "readme" and value is None:
+            inputs.extend(crate_dir / name for name in ("README.md", "README.txt", "README"))
+    build = table.get("build")
+    if isinstance(build, str):
+        inputs.append(crate_dir / build)
+    elif build is None:
+        inputs.append(crate_dir / "build.rs")
+    return inputs
+
+
+def package_cache_key(package: Package, version: str) -> str:
+    stamps: list[str] = []
+    for path in package_cache_inputs(package):
+        try:
+            stamps.append(str(path.stat().st_mtime_ns))
+        except FileNotFoundError:
+            stamps.append("-")
+    return ":".join([*stamps, version])
+
+
+def load_package_cache() -> dict[str, str]:
+    try:
+        cache = json.loads(PACKAGE_CACHE.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def save_package_cache(cache: dict[str, str]) -> None:
+    try:
+        PACKAGE_CACHE.parent.mkdir(parents=True, exist_ok=True)
+        PACKAGE_CACHE.write_text(json.dumps(cache, indent=2) + "\n", encoding="utf-8")
+    except OSError:
+        pass
+
+
+def run_cargo_package(packages: list[Package]) -> subprocess.CompletedProcess[str]:
+    cmd = ["cargo", "package"]
     for package in packages:
-        cmd = [
-            "cargo",
-            "package",
-            "-p",
-            package.name,
-            "--allow-dirty",
-            "--no-verify",
-            "--list",
-        ]
-        result = subprocess.run(
-            cmd,
-            cwd=ROOT,
-            text=True,
-            capture_output=True,
-            check=False,
-        )
-        if result.returncode != 0:
-            errors.append(
-                f"{package.name}: cargo package preflight failed\n{result.stderr.strip()}"
-            )
-    return errors
+        cmd.extend(["-p", package.name])
+    cmd.extend(["--allow-dirty", "--no-verify", "--list"])
+    return subprocess.run(
+        cmd,
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=False,
+    )
+
+
+def failing_package(packages: list[Package], stderr: str) -> Package | None:
+    if len(packages) == 1:
+        return packages[0]
+    by_name = {package.name: package for package in packages}
+    for name in FAILED_PACKAGE_RE.findall(stderr):
+        if name in by_name:
+            return by_name[name]
+    return None
+
+
+def package_list_failures(packages: list[Package]) -> list[tuple[Package, str]]:
+    # A single multi-package invocation loads the workspace and resolves the
+    # lockfile once, instead of once per crate. Cargo stops at the first
+    # failing crate, so after a failure the remaining crates are batched
+    # again without it.
+    failures: list[tuple[Package, str]] = []
+    remaining = list(packages)
+    while remaining:
+        result = run_cargo_package(remaining)
+        if result.returncode == 0:
+            break
+        stderr = result.stderr.strip()
+        package = failing_package(remaining, stderr)
+        if package is None:
+            # Cargo's output did not name a crate; fall back to checking each
+            # remaining crate alone.
+            singles: list[tuple[Package, str]] = []
+            for package in remaining:
+                single = run_cargo_package([package])
+                if single.returncode != 0:
+                    singles.append((package, single.stderr.strip()))
+            failures.extend(singles or [(package, stderr) for package in remaining])
+            break
+        failures.append((package, stderr))
+        remaining.remove(package)
+    return failures
+
+
+def check_package_list(packages: list[Package], use_cache: bool = False) -> list[str]:
+    version = cargo_version() if use_cache else None
+    cache = load_package_cache() if version else {}
+    stale = [
+        package
+        for package in packages
+        if not version or cache.get(str(package.manifest)) != package_cache_key(package, version)
+    ]
+    if not stale:
+        return []
+
+    failures = package_list_failures(stale)
+    failed = {package.name for package, _ in failures}
+    if version:
+        # Keys are recomputed after cargo ran, since cargo may have written
+        # Cargo.lock.
+        for package in stale:
+            manifest = str(package.manifest)
+            if package.name in failed:
+                cache.pop(manifest, None)
+            else:
+                cache[manifest] = package_cache_key(package, version)
+        save_package_cache(cache)
+    return [
+        f"{package.name}: cargo package preflight failed\n{stderr}"
+        for package, stderr in failures
+    ]
 
 
 def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--first-error",
+        action="store_true",
+        help="stop scanning manifests at the first path dependency violation",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="skip cargo package for crates whose tracked inputs are unchanged "
+        "since they last passed (local use only)",
+    )
+    args = parser.parse_args()
+
     packages = publishable_packages()
     print(f"publishable crates: {len(packages)}")
 
-    path_dep_errors = check_path_dependency_versions(packages)
+    path_dep_errors = check_path_dependency_versions(packages, args.first_error)
     if path_dep_errors:
         print("\npath dependency policy violations:")
         for error in path_dep_errors:
             print(f"- {error}")
         return 1
 
-    package_errors = check_package_list(packages)
+    package_errors = check_package_list(packages, args.cache)
     if package_errors:
         print("\ncargo package preflight failures:")
         for error in package_errors: